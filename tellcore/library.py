@@ -16,7 +16,7 @@
 # USA
 
 from ctypes import c_bool, c_char_p, c_int, c_ubyte, c_void_p
-from ctypes import byref, cast, create_string_buffer, POINTER, sizeof
+from ctypes import byref, create_string_buffer, POINTER, sizeof
 import platform
 import threading
 
@@ -47,6 +47,61 @@ CONTROLLER_EVENT_FUNC = FUNCTYPE(
     None, c_int, c_int, c_int, c_char_p, c_int, c_void_p)
 
 
+class _Functions(object):
+    """The C functions, with their return values checked, as attributes."""
+
+    def __init__(self, functions):
+        super(_Functions, self).__init__()
+        self.__dict__.update(functions)
+
+
+class _OutParams(threading.local):
+    """Output parameters that are reused between calls, one set per thread."""
+
+    def __init__(self):
+        super(_OutParams, self).__init__()
+        self.sensor = (create_string_buffer(20), create_string_buffer(20),
+                       c_int(), c_int())
+        self.sensor_value = (create_string_buffer(20), c_int())
+        self.controller = (c_int(), c_int(), create_string_buffer(255),
+                           c_int())
+        self.controller_value = create_string_buffer(255)
+
+
+_out_params = _OutParams()
+
+try:
+    _TEXT_TYPES = (str, unicode)
+except NameError:
+    _TEXT_TYPES = (str,)  # The unicode type does not exist in python 3
+
+
+def _decode(string):
+    if string is None:
+        return None
+    return string.decode(Library.STRING_ENCODING)
+
+
+# The return values are checked by wrapping the functions instead of setting
+# errcheck, as that saves a callback from ctypes per call.
+def _check_int_result(func):
+    def call(*args):
+        result = func(*args)
+        if result < 0:
+            raise TelldusError(result)
+        return result
+    return call
+
+
+def _check_bool_result(func):
+    def call(*args):
+        result = func(*args)
+        if not result:
+            raise TelldusError(const.TELLSTICK_ERROR_DEVICE_NOT_FOUND)
+        return result
+    return call
+
+
 class TelldusError(Exception):
     """Error returned from Telldus Core API.
 
@@ -57,14 +112,23 @@ class TelldusError(Exception):
         :mod:`tellcore.constants`).
     """
 
+    # (Error code, string settings) -> error string, as returned from the C
+    # API. The type and encoding of the string depend on the settings.
+    _messages = {}
+
     def __init__(self, error, lib=None):
         super(TelldusError, self).__init__()
         self.error = error
-        self.lib = lib or Library()
+        # The library is only needed (and loaded) when formatting the error
+        self.lib = lib
 
     def __str__(self):
         """Return the human readable error string."""
-        msg = self.lib.tdGetErrorString(self.error)
+        key = (self.error, Library.DECODE_STRINGS, Library.STRING_ENCODING)
+        msg = TelldusError._messages.get(key)
+        if msg is None:
+            msg = (self.lib or Library()).tdGetErrorString(self.error)
+            TelldusError._messages[key] = msg
         return "%s (%d)" % (msg, self.error)
 
 
@@ -116,72 +180,105 @@ class Library(object):
     DECODE_STRINGS = True
 
     class c_string_p(c_char_p):
-        def __init__(self, param):
-            c_char_p.__init__(self, param.encode(Library.STRING_ENCODING))
+        # Already converted strings. Mostly the same few strings are passed
+        # (e.g. parameter names), so this saves encoding them on every call.
+        # The size is limited as any string can be passed, so the cache is
+        # emptied when full to make room for the strings currently in use. The
+        # encoding is part of the key, as STRING_ENCODING can be changed at any
+        # time.
+        _cache = {}
+        _cache_size = 512
 
         @classmethod
         def from_param(cls, param):
-            if type(param) is str:
-                return cls(param)
-            try:
-                if type(param) is unicode:
-                    return cls(param)
-            except NameError:
-                pass  # The unicode type does not exist in python 3
+            if type(param) in _TEXT_TYPES:
+                # ctypes accepts bytes for char*, so there is no need to wrap
+                # the encoded string in an instance of this class.
+                encoding = Library.STRING_ENCODING
+                key = (param, encoding)
+                converted = cls._cache.get(key)
+                if converted is None:
+                    converted = param.encode(encoding)
+                    if len(cls._cache) >= cls._cache_size:
+                        cls._cache.clear()
+                    cls._cache[key] = converted
+                return converted
             return c_char_p.from_param(param)
 
     # Must be a separate class (i.e. not part of Library), to avoid circular
     # references when saving the wrapper callback function in a class with a
     # destructor, as the destructor is not called in that case.
     class CallbackWrapper(object):
+        # Converts the arguments of each callback type to what is passed on
+        # to the dispatcher. All char* parameters (i.e. bytes) are decoded to
+        # proper python strings and the last parameter, which is the context
+        # and always None, is dropped.
+        _decoders = {
+            DEVICE_EVENT_FUNC:
+            lambda device_id, method, data, cid, context:
+            (device_id, method, _decode(data), cid),
+            DEVICE_CHANGE_EVENT_FUNC:
+            lambda device_id, event, type_, cid, context:
+            (device_id, event, type_, cid),
+            RAW_DEVICE_EVENT_FUNC:
+            lambda data, controller_id, cid, context:
+            (_decode(data), controller_id, cid),
+            SENSOR_EVENT_FUNC:
+            lambda protocol, model, sensor_id, datatype, value, timestamp, cid,
+            context:
+            (_decode(protocol), _decode(model), sensor_id, datatype,
+             _decode(value), timestamp, cid),
+            CONTROLLER_EVENT_FUNC:
+            lambda controller_id, event, type_, new_value, cid, context:
+            (controller_id, event, type_, _decode(new_value), cid),
+        }
+
         def __init__(self, dispatcher):
-            self._callbacks = {}
+            # Indexed by callback id, which are small integers handed out in
+            # sequence, with None for unused ids. Keeps the wrapper functions
+            # alive while they are registered.
+            self._callbacks = []
             self._lock = threading.Lock()
             self._dispatcher = dispatcher
 
         def get_callback_ids(self):
             with self._lock:
-                return list(self._callbacks.keys())
+                return [cid for (cid, wrapper) in enumerate(self._callbacks)
+                        if wrapper is not None]
 
         def register_callback(self, registrator, functype, callback):
-            wrapper = functype(self._callback)
+            # Everything needed to dispatch the callback is known here, so
+            # bind it in a closure instead of looking it up on every call.
+            decoder = self._decoders[functype]
+            dispatcher = self._dispatcher
+
+            def dispatch(*args):
+                args = decoder(*args)
+                try:
+                    dispatcher.on_callback(callback, *args)
+                except Exception:
+                    pass
+
+            wrapper = functype(dispatch)
             with self._lock:
                 cid = registrator(wrapper, None)
-                self._callbacks[cid] = (wrapper, callback)
+                if cid >= len(self._callbacks):
+                    self._callbacks.extend(
+                        [None] * (cid + 1 - len(self._callbacks)))
+                self._callbacks[cid] = wrapper
                 return cid
 
         def unregister_callback(self, cid):
             with self._lock:
-                del self._callbacks[cid]
-
-        def _callback(self, *in_args):
-            args = []
-            # Convert all char* parameters (i.e. bytes) to proper python
-            # strings
-            for arg in in_args:
-                if type(arg) is bytes:
-                    args.append(arg.decode(Library.STRING_ENCODING))
-                else:
-                    args.append(arg)
-
-            # Get the real callback and the dispatcher
-            with self._lock:
-                try:
-                    # args[-2] is callback id
-                    (wrapper, callback) = self._callbacks[args[-2]]
-                except KeyError:
-                    return
-                dispatcher = self._dispatcher
-
-            # Dispatch the callback, dropping the last parameter which is the
-            # context and always None.
-            try:
-                dispatcher.on_callback(callback, *args[:-1])
-            except:
-                pass
+                if not 0 <= cid < len(self._callbacks) or \
+                        self._callbacks[cid] is None:
+                    raise KeyError(cid)
+                self._callbacks[cid] = None
 
     _lib = None
     _refcount = 0
+    _funcs = None
+    _bound = {}
 
     _functions = {
         'tdInit': [None, []],
@@ -252,40 +349,52 @@ class Library(object):
         return char_p.value.decode(Library.STRING_ENCODING)
 
     def _setup_functions(self, lib):
-        def check_int_result(result, func, args):
-            if result < 0:
-                raise TelldusError(result)
-            return result
-
-        def check_bool_result(result, func, args):
-            if not result:
-                raise TelldusError(const.TELLSTICK_ERROR_DEVICE_NOT_FOUND)
-            return result
-
-        def free_string(result, func, args):
-            string = cast(result, c_char_p).value
-            if string is not None:
-                lib.tdReleaseString(result)
-                if Library.DECODE_STRINGS:
-                    string = string.decode(Library.STRING_ENCODING)
-            return string
-
+        # Already decoded strings. The same few strings (names, protocols,
+        # models etc.) are returned over and over again, so this saves decoding
+        # them on every call. Like for c_string_p, the cache is emptied when
+        # full and the encoding is part of the key.
+        decoded = {}
+        decoded_size = 512
+
+        def free_string(func):
+            def call(*args):
+                result = func(*args)
+                # result is the address of the string (or None)
+                string = c_char_p(result).value
+                if string is not None:
+                    lib.tdReleaseString(result)
+                    if Library.DECODE_STRINGS:
+                        encoding = Library.STRING_ENCODING
+                        key = (string, encoding)
+                        string = decoded.get(key)
+                        if string is None:
+                            string = key[0].decode(encoding)
+                            if len(decoded) >= decoded_size:
+                                decoded.clear()
+                            decoded[key] = string
+                return string
+            return call
+
+        functions = {}
         for name, signature in Library._functions.items():
             try:
                 func = getattr(lib, name)
-                func.restype = signature[0]
-                func.argtypes = signature[1]
-
-                if func.restype == c_int:
-                    func.errcheck = check_int_result
-                elif func.restype == c_bool:
-                    func.errcheck = check_bool_result
-                elif func.restype == c_char_p:
-                    func.restype = c_void_p
-                    func.errcheck = free_string
             except AttributeError:
                 # Older version of the lib don't have all the functions
-                pass
+                continue
+
+            func.restype = signature[0]
+            func.argtypes = signature[1]
+
+            if func.restype == c_int:
+                func = _check_int_result(func)
+            elif func.restype == c_bool:
+                func = _check_bool_result(func)
+            elif func.restype == c_char_p:
+                func.restype = c_void_p
+                func = free_string(func)
+            functions[name] = func
+        return functions
 
     def __init__(self, name=None, callback_dispatcher=None):
         """Load and initialize the Telldus core library.
@@ -310,11 +419,26 @@ class Library(object):
                 name = LIBRARY_NAME
 
             lib = DllLoader.LoadLibrary(name)
-            self._setup_functions(lib)
+            functions = self._setup_functions(lib)
             lib.tdInit()
             Library._lib = lib
+            Library._funcs = _Functions(functions)
+            # Functions wrapped by a method in this class must not be shadowed
+            Library._bound = dict(
+                (name, func) for (name, func) in functions.items()
+                if name not in Library.__dict__)
 
         Library._refcount += 1
+        # Put the C functions directly in the instance dict so that calls
+        # don't have to go through __getattr__. Methods in subclasses must not
+        # be shadowed either.
+        cls = type(self)
+        if cls is Library:
+            self.__dict__.update(Library._bound)
+        else:
+            self.__dict__.update(
+                (name, func) for (name, func) in Library._bound.items()
+                if not hasattr(cls, name))
         if callback_dispatcher is not None:
             self._callback_wrapper = Library.CallbackWrapper(
                 callback_dispatcher)
@@ -329,39 +453,41 @@ class Library(object):
         The underlaying library is only closed and unloaded if this is the last
         instance sharing the same underlaying library instance.
         """
-        # Using self.__class__.* instead of Library.* here to avoid a
-        # strange problem where Library could, in some runs, be None.
+        # Using the class of self instead of Library.* here to avoid a
+        # strange problem where Library could, in some runs, be None. The
+        # shared state is kept in Library, also for instances of subclasses.
+        cls = next(c for c in type(self).__mro__ if '_refcount' in vars(c))
 
         # Happens if the LoadLibrary call fails
-        if self.__class__._lib is None:
-            assert self.__class__._refcount == 0
+        if cls._lib is None:
+            assert cls._refcount == 0
             return
 
-        assert self.__class__._refcount >= 1
-        self.__class__._refcount -= 1
+        assert cls._refcount >= 1
+        cls._refcount -= 1
 
         if self._callback_wrapper is not None:
             for cid in self._callback_wrapper.get_callback_ids():
                 try:
                     self.tdUnregisterCallback(cid)
-                except:
+                except Exception:
                     pass
 
-        if self.__class__._refcount != 0:
+        if cls._refcount != 0:
             return
 
         # telldus-core before v2.1.2 (where tdController was added) does not
         # handle re-initialization after tdClose has been called (see Telldus
         # ticket 188).
-        if hasattr(self.__class__._lib, "tdController"):
-            self.__class__._lib.tdClose()
-        self.__class__._lib = None
+        if hasattr(cls._lib, "tdController"):
+            cls._lib.tdClose()
+        cls._lib = None
+        cls._funcs = None
+        cls._bound = {}
 
     def __getattr__(self, name):
         if name == 'callback_dispatcher':
             return self._callback_wrapper._dispatcher
-        if name in Library._functions:
-            return getattr(self._lib, name)
         raise AttributeError(name)
 
     def tdInit(self):
@@ -376,48 +502,46 @@ class Library(object):
     def tdRegisterDeviceEvent(self, callback):
         assert(self._callback_wrapper is not None)
         return self._callback_wrapper.register_callback(
-            self._lib.tdRegisterDeviceEvent, DEVICE_EVENT_FUNC, callback)
+            self._funcs.tdRegisterDeviceEvent, DEVICE_EVENT_FUNC, callback)
 
     def tdRegisterDeviceChangeEvent(self, callback):
         assert(self._callback_wrapper is not None)
         return self._callback_wrapper.register_callback(
-            self._lib.tdRegisterDeviceChangeEvent, DEVICE_CHANGE_EVENT_FUNC,
+            self._funcs.tdRegisterDeviceChangeEvent, DEVICE_CHANGE_EVENT_FUNC,
             callback)
 
     def tdRegisterRawDeviceEvent(self, callback):
         assert(self._callback_wrapper is not None)
         return self._callback_wrapper.register_callback(
-            self._lib.tdRegisterRawDeviceEvent, RAW_DEVICE_EVENT_FUNC,
+            self._funcs.tdRegisterRawDeviceEvent, RAW_DEVICE_EVENT_FUNC,
             callback)
 
     def tdRegisterSensorEvent(self, callback):
         assert(self._callback_wrapper is not None)
         return self._callback_wrapper.register_callback(
-            self._lib.tdRegisterSensorEvent, SENSOR_EVENT_FUNC, callback)
+            self._funcs.tdRegisterSensorEvent, SENSOR_EVENT_FUNC, callback)
 
     def tdRegisterControllerEvent(self, callback):
         assert(self._callback_wrapper is not None)
         return self._callback_wrapper.register_callback(
-            self._lib.tdRegisterControllerEvent, CONTROLLER_EVENT_FUNC,
+            self._funcs.tdRegisterControllerEvent, CONTROLLER_EVENT_FUNC,
             callback)
 
     def tdUnregisterCallback(self, cid):
         assert(self._callback_wrapper is not None)
         self._callback_wrapper.unregister_callback(cid)
-        self._lib.tdUnregisterCallback(cid)
+        self._funcs.tdUnregisterCallback(cid)
 
     def tdSensor(self):
         """Get the next sensor while iterating.
 
         :return: a dict with the keys: protocol, model, id, datatypes.
         """
-        protocol = create_string_buffer(20)
-        model = create_string_buffer(20)
-        sid = c_int()
-        datatypes = c_int()
+        (protocol, model, sid, datatypes) = _out_params.sensor
+        protocol.value = model.value = b''
 
-        self._lib.tdSensor(protocol, sizeof(protocol), model, sizeof(model),
-                           byref(sid), byref(datatypes))
+        self._funcs.tdSensor(protocol, sizeof(protocol), model,
+                             sizeof(model), byref(sid), byref(datatypes))
         return {'protocol': self._to_str(protocol),
                 'model': self._to_str(model),
                 'id': sid.value, 'datatypes': datatypes.value}
@@ -427,11 +551,11 @@ class Library(object):
 
         :return: a dict with the keys: value, timestamp.
         """
-        value = create_string_buffer(20)
-        timestamp = c_int()
+        (value, timestamp) = _out_params.sensor_value
+        value.value = b''
 
-        self._lib.tdSensorValue(protocol, model, sid, datatype,
-                                value, sizeof(value), byref(timestamp))
+        self._funcs.tdSensorValue(protocol, model, sid, datatype,
+                                  value, sizeof(value), byref(timestamp))
         return {'value': self._to_str(value), 'timestamp': timestamp.value}
 
     def tdController(self):
@@ -439,18 +563,17 @@ class Library(object):
 
         :return: a dict with the keys: id, type, name, available.
         """
-        cid = c_int()
-        ctype = c_int()
-        name = create_string_buffer(255)
-        available = c_int()
+        (cid, ctype, name, available) = _out_params.controller
+        name.value = b''
 
-        self._lib.tdController(byref(cid), byref(ctype), name, sizeof(name),
-                               byref(available))
+        self._funcs.tdController(byref(cid), byref(ctype), name,
+                                 sizeof(name), byref(available))
         return {'id': cid.value, 'type': ctype.value,
                 'name': self._to_str(name), 'available': available.value}
 
     def tdControllerValue(self, cid, name):
-        value = create_string_buffer(255)
+        value = _out_params.controller_value
+        value.value = b''
 
-        self._lib.tdControllerValue(cid, name, value, sizeof(value))
+        self._funcs.tdControllerValue(cid, name, value, sizeof(value))
         return self._to_str(value)
@@ -15,16 +15,12 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
-try:
-    import queue
-except ImportError:
-    # Fall back on old (python 2) variant
-    import Queue as queue
-
 import tellcore.constants as const
 from tellcore.library import Library, TelldusError, BaseCallbackDispatcher
 
+from collections import deque, OrderedDict
 from datetime import datetime
+import threading
 
 
 class QueuedCallbackDispatcher(BaseCallbackDispatcher):
@@ -40,10 +36,17 @@ class QueuedCallbackDispatcher(BaseCallbackDispatcher):
 
     def __init__(self):
         super(QueuedCallbackDispatcher, self).__init__()
-        self._queue = queue.Queue()
+        # Appending to and popping from a deque is atomic, so no lock is
+        # needed. The event is only used to wake up a blocked reader.
+        self._queue = deque()
+        self._queued = threading.Event()
 
     def on_callback(self, callback, *args):
-        self._queue.put((callback, args))
+        self._queue.append((callback, args))
+        # The event stays set until a reader is about to block, so setting
+        # it (which takes a lock) is usually not needed.
+        if not self._queued.is_set():
+            self._queued.set()
 
     def process_callback(self, block=True):
         """Dispatch a single callback in the current thread.
@@ -51,20 +54,91 @@ class QueuedCallbackDispatcher(BaseCallbackDispatcher):
         :param boolean block: If True, blocks waiting for a callback to come.
         :return: True if a callback was processed; otherwise False.
         """
-        try:
-            (callback, args) = self._queue.get(block=block)
-            try:
-                callback(*args)
-            finally:
-                self._queue.task_done()
-        except queue.Empty:
+        if not block and not self._queue:
             return False
+        while True:
+            try:
+                (callback, args) = self._queue.popleft()
+                break
+            except IndexError:
+                if not block:
+                    return False
+                # Clear before checking again, so that a callback queued
+                # in between is not missed.
+                self._queued.clear()
+                if not self._queue:
+                    self._queued.wait()
+        callback(*args)
         return True
 
     def process_pending_callbacks(self):
         """Dispatch all pending callbacks in the current thread."""
-        while self.process_callback(block=False):
-            pass
+        queue = self._queue
+        while queue:
+            try:
+                (callback, args) = queue.popleft()
+            except IndexError:
+                # Emptied by another thread calling process_callback
+                break
+            callback(*args)
+
+
+class CoalescingCallbackDispatcher(BaseCallbackDispatcher):
+    """Queues callbacks like :class:`QueuedCallbackDispatcher`, but only keeps
+    the latest pending callback for each event source.
+
+    Useful when events arrive faster than they can be handled (e.g. while
+    dimming a device with a slider) and only the latest state is of
+    interest. Call :func:`process_pending_callbacks` regularly, e.g. at the
+    rate the hardware can handle, to dispatch the callbacks in the current
+    thread.
+
+    Pending events for the same registered callback are coalesced if the key
+    function returns the same key for them. The key function is called with
+    the callback arguments. The default key depends on the type of event:
+
+    * device events: the device id
+    * device change events: the device id, change event and change type
+    * raw device events: the raw data
+    * sensor events: the protocol, model, sensor id and data type
+    * controller events: the controller id, change event and change type
+    """
+
+    def __init__(self, key=None):
+        super(CoalescingCallbackDispatcher, self).__init__()
+        self._key = key or self._default_key
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+
+    @staticmethod
+    def _default_key(*args):
+        # The event type is told apart by the number of arguments (including
+        # the callback id) and, for the two types with four arguments, by the
+        # type of the third one (data string vs. change type).
+        if len(args) == 7:
+            # protocol, model, id, datatype, value, timestamp, cid
+            return args[:4]
+        if len(args) == 4 and isinstance(args[2], int):
+            # device_id, event, change_type, cid
+            return args[:3]
+        if len(args) == 5:
+            # controller_id, event, change_type, new_value, cid
+            return args[:3]
+        return args[0]
+
+    def on_callback(self, callback, *args):
+        # The last argument is the callback id
+        key = (args[-1], self._key(*args))
+        with self._lock:
+            self._pending[key] = (callback, args)
+
+    def process_pending_callbacks(self):
+        """Dispatch all pending callbacks in the current thread."""
+        with self._lock:
+            pending = self._pending
+            self._pending = OrderedDict()
+        for (callback, args) in pending.values():
+            callback(*args)
 
 
 class AsyncioCallbackDispatcher(BaseCallbackDispatcher):
@@ -77,9 +151,31 @@ class AsyncioCallbackDispatcher(BaseCallbackDispatcher):
     def __init__(self, loop):
         super(AsyncioCallbackDispatcher, self).__init__()
         self._loop = loop
+        self._lock = threading.Lock()
+        self._pending = deque()
 
     def on_callback(self, callback, *args):
-        self._loop.call_soon_threadsafe(callback, *args)
+        # Waking up the loop is only needed for the first of a burst of
+        # callbacks. The rest are picked up by the same wake up.
+        with self._lock:
+            wake_up = not self._pending
+            self._pending.append((callback, args))
+        if wake_up:
+            try:
+                self._loop.call_soon_threadsafe(self._schedule_pending)
+            except Exception:
+                # Without a scheduled wake up the pending callbacks would never
+                # be processed and, since the deque is not empty, later
+                # callbacks would never wake up the loop either.
+                with self._lock:
+                    self._pending.clear()
+                raise
+
+    def _schedule_pending(self):
+        with self._lock:
+            (pending, self._pending) = (self._pending, deque())
+        for (callback, args) in pending:
+            self._loop.call_soon(callback, *args)
 
 
 class TelldusCore(object):
@@ -171,12 +267,10 @@ class TelldusCore(object):
 
         :return: list of :class:`Device` or :class:`DeviceGroup` instances.
         """
-        devices = []
-        count = self.lib.tdGetNumberOfDevices()
-        for i in range(count):
-            device = DeviceFactory(self.lib.tdGetDeviceId(i), lib=self.lib)
-            devices.append(device)
-        return devices
+        lib = self.lib
+        count = lib.tdGetNumberOfDevices()
+        return [DeviceFactory(lib.tdGetDeviceId(i), lib=lib)
+                for i in range(count)]
 
     def sensors(self):
         """Return all known sensors.
@@ -233,7 +327,7 @@ class TelldusCore(object):
             exc_info = sys.exc_info()
             try:
                 device.remove()
-            except:
+            except Exception:
                 pass
 
             if "with_traceback" in dir(Exception):
@@ -282,59 +376,71 @@ class Device(object):
     :func:`TelldusCore.add_device` or :func:`TelldusCore.devices`.
     """
 
+    __slots__ = ('id', 'lib')
+
     PARAMETERS = ["devices", "house", "unit", "code", "system", "units",
                   "fade"]
 
-    def __init__(self, id, lib=None):
-        super(Device, self).__init__()
+    # Returned by the library for parameters that are not set
+    _DEFAULT_PARAMETER = "$%!)(INVALID)(!%$"
 
-        lib = lib or Library()
-        super(Device, self).__setattr__('id', id)
-        super(Device, self).__setattr__('lib', lib)
+    def __init__(self, id, lib=None):
+        self.id = id
+        self.lib = lib or Library()
 
     def remove(self):
         """Remove the device from Telldus Core."""
         return self.lib.tdRemoveDevice(self.id)
 
-    def __getattr__(self, name):
-        if name == 'name':
-            func = self.lib.tdGetName
-        elif name == 'protocol':
-            func = self.lib.tdGetProtocol
-        elif name == 'model':
-            func = self.lib.tdGetModel
-        elif name == 'type':
-            func = self.lib.tdGetDeviceType
-        else:
-            raise AttributeError(name)
-        return func(self.id)
-
-    def __setattr__(self, name, value):
-        if name == 'name':
-            func = self.lib.tdSetName
-        elif name == 'protocol':
-            func = self.lib.tdSetProtocol
-        elif name == 'model':
-            func = self.lib.tdSetModel
-        else:
-            raise AttributeError(name)
-        func(self.id, value)
+    @property
+    def name(self):
+        """The name of the device (read/write)."""
+        return self.lib.tdGetName(self.id)
+
+    @name.setter
+    def name(self, name):
+        self.lib.tdSetName(self.id, name)
+
+    @property
+    def protocol(self):
+        """The protocol used for the device (read/write)."""
+        return self.lib.tdGetProtocol(self.id)
+
+    @protocol.setter
+    def protocol(self, protocol):
+        self.lib.tdSetProtocol(self.id, protocol)
+
+    @property
+    def model(self):
+        """The device's model (read/write)."""
+        return self.lib.tdGetModel(self.id)
+
+    @model.setter
+    def model(self, model):
+        self.lib.tdSetModel(self.id, model)
+
+    @property
+    def type(self):
+        """The device type (read only). One of the device type constants from
+        :mod:`tellcore.constants`.
+        """
+        return self.lib.tdGetDeviceType(self.id)
 
     def parameters(self):
         """Get dict with all set parameters."""
         parameters = {}
         for name in self.PARAMETERS:
-            try:
-                parameters[name] = self.get_parameter(name)
-            except AttributeError:
-                pass
+            value = self.lib.tdGetDeviceParameter(
+                self.id, name, self._DEFAULT_PARAMETER)
+            if value != self._DEFAULT_PARAMETER:
+                parameters[name] = value
         return parameters
 
     def get_parameter(self, name):
         """Get a parameter."""
-        default_value = "$%!)(INVALID)(!%$"
-        value = self.lib.tdGetDeviceParameter(self.id, name, default_value)
-        if value == default_value:
+        value = self.lib.tdGetDeviceParameter(
+            self.id, name, self._DEFAULT_PARAMETER)
+        if value == self._DEFAULT_PARAMETER:
             raise AttributeError(name)
         return value
 
@@ -403,6 +509,8 @@ class DeviceGroup(Device):
     E.g. when a group is turned on, all devices in that group are turned on.
     """
 
+    __slots__ = ()
+
     def add_to_group(self, devices):
         """Add device(s) to the group."""
         ids = {d.id for d in self.devices_in_group()}
@@ -442,7 +550,7 @@ class DeviceGroup(Device):
         return ids
 
     def _set_group(self, ids):
-        self.set_parameter('devices', ','.join([str(x) for x in ids]))
+        self.set_parameter('devices', ','.join(map(str, ids)))
 
 
 class Sensor(object):
@@ -451,6 +559,8 @@ class Sensor(object):
     Returned from :func:`TelldusCore.sensors`
     """
 
+    __slots__ = ('protocol', 'model', 'id', 'datatypes', 'lib')
+
     DATATYPES = {"temperature": const.TELLSTICK_TEMPERATURE,
                  "humidity": const.TELLSTICK_HUMIDITY,
                  "rainrate": const.TELLSTICK_RAINRATE,
@@ -460,7 +570,6 @@ class Sensor(object):
                  "windgust": const.TELLSTICK_WINDGUST}
 
     def __init__(self, protocol, model, id, datatypes, lib=None):
-        super(Sensor, self).__init__()
         self.protocol = protocol
         self.model = model
         self.id = id
@@ -485,15 +594,20 @@ class Sensor(object):
             self.protocol, self.model, self.id, datatype)
         return SensorValue(datatype, value['value'], value['timestamp'])
 
-    def __getattr__(self, name):
-        typename = name.replace("has_", "", 1)
-        if typename in Sensor.DATATYPES:
-            datatype = Sensor.DATATYPES[typename]
-            if name == typename:
-                return lambda: self.value(datatype)
-            else:
-                return lambda: self.has_value(datatype)
-        raise AttributeError(name)
+
+def _add_datatype_methods(cls):
+    # Adds e.g. temperature() and has_temperature() for each data type, as
+    # plain methods so that calling them does not go through __getattr__.
+    def add_methods(typename, datatype):
+        setattr(cls, typename, lambda self: self.value(datatype))
+        setattr(cls, "has_" + typename,
+                lambda self: self.has_value(datatype))
+
+    for typename, datatype in cls.DATATYPES.items():
+        add_methods(typename, datatype)
+
+
+_add_datatype_methods(Sensor)
 
 
 class SensorValue(object):
@@ -502,16 +616,24 @@ class SensorValue(object):
     Returned from :func:`Sensor.value`.
     """
 
+    __slots__ = ('datatype', 'value', 'timestamp', '_datetime')
+
     def __init__(self, datatype, value, timestamp):
-        super(SensorValue, self).__init__()
         self.datatype = datatype
         self.value = value
         self.timestamp = timestamp
+        self._datetime = None
 
-    def __getattr__(self, name):
-        if name == "datetime":
-            return datetime.fromtimestamp(self.timestamp)
-        raise AttributeError(name)
+    @property
+    def datetime(self):
+        """The timestamp as a :class:`datetime.datetime` (local time)."""
+        # Cached together with the timestamp it was created from, as the
+        # timestamp attribute can be reassigned.
+        cached = self._datetime
+        if cached is None or cached[0] != self.timestamp:
+            cached = (self.timestamp, datetime.fromtimestamp(self.timestamp))
+            self._datetime = cached
+        return cached[1]
 
 
 class Controller(object):
@@ -520,10 +642,11 @@ class Controller(object):
     Returned from :func:`TelldusCore.controllers`
     """
 
+    __slots__ = ('id', 'type', 'lib')
+
     def __init__(self, id, type, lib=None):
         lib = lib or Library()
 
-        super(Controller, self).__init__()
         super(Controller, self).__setattr__('id', id)
         super(Controller, self).__setattr__('type', type)
         super(Controller, self).__setattr__('lib', lib)
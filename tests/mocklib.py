@@ -28,9 +28,24 @@ import tellcore.library
 ByRefArgType = type(ctypes.byref(ctypes.c_int(0)))
 
 
+def convert_argument(c_type, value):
+    """Verify that value is of the correct type and return what is passed."""
+    # The 'raw' attribute is the pointer for string buffers
+    if hasattr(value, 'raw'):
+        c_type.from_param(value.raw)
+    elif type(value) is not ByRefArgType:
+        param = c_type.from_param(value)
+        # Like the real thing, pass what from_param returned if it is a value
+        # that can be passed as is (e.g. bytes for char*). Otherwise pass the
+        # possibly converted value instead of the original.
+        if type(param) is bytes:
+            return param
+        return c_type(value).value
+    return value
+
+
 class MockLibLoader(object):
     def __init__(self, mocklib):
-        object.__init__(self)
         self.load_count = 0
         self.mocklib = mocklib
 
@@ -41,8 +56,6 @@ class MockLibLoader(object):
 
 class MockTelldusCoreLib(object):
     def __init__(self):
-        object.__init__(self)
-
         self.tdInit = lambda: None
         self.tdClose = lambda: None
 
@@ -66,13 +79,22 @@ class MockTelldusCoreLib(object):
 
 class MockCFunction(object):
     def __init__(self, name, lib):
-        object.__init__(self)
         self.name = name
         self.lib = lib
         self.implementation = None
         self.restype = None
         self.argtypes = None
         self.errcheck = None
+        self.string = None
+
+    @property
+    def argtypes(self):
+        return self._argtypes
+
+    @argtypes.setter
+    def argtypes(self, argtypes):
+        self._argtypes = argtypes
+        self._nargs = None if argtypes is None else len(argtypes)
 
     def __call__(self, *args):
         if self.implementation is None:
@@ -81,30 +103,23 @@ class MockCFunction(object):
         if self.argtypes is None:
             raise NotImplementedError("%s not configured" % self.name)
 
-        if len(self.argtypes) != len(args):
+        if self._nargs != len(args):
             raise TypeError("%s() takes exactly %d argument(s) (%d given)" %
-                            (self.name, len(self.argument), len(args)))
-
-        c_args = []
-
-        # Verify that the arguments are of correct type
-        for c_type, value in zip(self.argtypes, args):
-            c_args.append(value)
-            if type(value) is not c_type:
-                # The 'raw' attribute is the pointer for string buffers
-                if hasattr(value, 'raw'):
-                    c_type.from_param(value.raw)
-                elif type(value) is not ByRefArgType:
-                    c_type.from_param(value)
-                    # Pass the possibly converted value instead of the original
-                    c_args[-1] = c_type(value).value
+                            (self.name, self._nargs, len(args)))
+
+        c_args = [value if type(value) is c_type
+                  else convert_argument(c_type, value)
+                  for (c_type, value) in zip(self.argtypes, args)]
 
         res = self.implementation(*c_args)
 
         # Functions returning char pointers are set up to return the pointer as
-        # a void pointer. Do the conversion here to match the real thing.
+        # a void pointer, i.e. as an int (or None). Do the conversion here to
+        # match the real thing. A reference to the returned string is kept so
+        # that the pointer stays valid after returning.
         if self.restype is ctypes.c_void_p:
-            res = ctypes.cast(res, ctypes.c_void_p)
+            self.string = res
+            res = ctypes.cast(res, ctypes.c_void_p).value
         # For the rest, verify that the return value is of correct type.
         elif self.restype is not None:
             self.restype.from_param(res)
@@ -48,6 +48,8 @@ class Test(unittest.TestCase):
         self.loader = mocklib.MockLibLoader(self.mocklib)
         tellcore.library.DllLoader = self.loader
 
+        TelldusError._messages.clear()
+
     def tearDown(self):
         gc.collect()
 
@@ -91,12 +93,24 @@ class Test(unittest.TestCase):
         self.assertRaises(NotImplementedError, lib.tdClose)
         self.assertRaises(NotImplementedError, lib.tdReleaseString, 0)
 
+    def test_subclass_override(self):
+        self.mocklib.tdTurnOn = lambda id: TELLSTICK_SUCCESS
+        self.mocklib.tdTurnOff = lambda id: TELLSTICK_SUCCESS
+
+        class SubLibrary(Library):
+            def tdTurnOn(self, id):
+                return "overridden"
+
+        lib = SubLibrary()
+        self.assertEqual(lib.tdTurnOn(1), "overridden")
+        self.assertEqual(lib.tdTurnOff(1), TELLSTICK_SUCCESS)
+
     def test_string_releaser(self):
         """Test that all strings returned from core lib are released"""
         released = []
 
         def tdReleaseString(pointer):
-            released.append(pointer.value)
+            released.append(pointer)
         self.mocklib.tdReleaseString = tdReleaseString
 
         returned = []
@@ -167,6 +181,68 @@ class Test(unittest.TestCase):
 
         lib.tdSetName(1, test_name.decode(Library.STRING_ENCODING))
 
+    def test_cached_strings(self):
+        """Test that repeated strings are released and follow the encoding"""
+        test_name = b'\xc3\xa5\xc3\xa4\xc3\xb6'
+        released = []
+        set_names = []
+
+        def tdReleaseString(pointer):
+            released.append(pointer)
+        self.mocklib.tdReleaseString = tdReleaseString
+
+        def tdGetName(id):
+            return ctypes.c_char_p(test_name)
+        self.mocklib.tdGetName = tdGetName
+
+        def tdSetName(id, name):
+            set_names.append(name)
+            return True
+        self.mocklib.tdSetName = tdSetName
+
+        lib = Library()
+        encoding = Library.STRING_ENCODING
+        try:
+            for i in range(2):
+                self.assertEqual(lib.tdGetName(1), test_name.decode('utf-8'))
+                lib.tdSetName(1, test_name.decode('utf-8'))
+            self.assertEqual(len(released), 2)
+
+            Library.STRING_ENCODING = 'latin-1'
+            self.assertEqual(lib.tdGetName(1), test_name.decode('latin-1'))
+            lib.tdSetName(1, test_name.decode('utf-8'))
+            self.assertEqual(len(released), 3)
+        finally:
+            Library.STRING_ENCODING = encoding
+
+        self.assertEqual(set_names, [test_name, test_name,
+                                     test_name.decode('utf-8').encode(
+                                         'latin-1')])
+
+    def test_string_cache_size(self):
+        """Test that new strings are still cached when the cache is full"""
+        set_names = []
+
+        def tdSetName(id, name):
+            set_names.append(name)
+            return True
+        self.mocklib.tdSetName = tdSetName
+
+        lib = Library()
+        cache = Library.c_string_p._cache
+        cache.clear()
+        size = Library.c_string_p._cache_size
+        Library.c_string_p._cache_size = 2
+        try:
+            for name in ["first", "second", "third"]:
+                lib.tdSetName(1, name)
+            self.assertEqual(len(cache), 1)
+            self.assertIn(("third", Library.STRING_ENCODING), cache)
+        finally:
+            Library.c_string_p._cache_size = size
+            cache.clear()
+        self.assertEqual(set_names, [b"first", b"second", b"third"])
+
     def setup_callback(self, registered_ids, unregistered_ids):
         def tdRegisterEvent(*args):
             cid = len(registered_ids) + 1
@@ -246,5 +322,35 @@ class Test(unittest.TestCase):
         self.assertEqual(cm.exception.error,
                          TELLSTICK_ERROR_CONNECTING_SERVICE)
 
+    def test_error_without_library(self):
+        error = TelldusError(TELLSTICK_ERROR_NOT_FOUND)
+        self.assertEqual(error.error, TELLSTICK_ERROR_NOT_FOUND)
+        self.assertEqual(self.loader.load_count, 0)
+
+    def test_error_string_cached(self):
+        calls = []
+
+        def tdGetErrorString(error):
+            calls.append(error)
+            return ctypes.c_char_p(b"an error")
+        self.mocklib.tdGetErrorString = tdGetErrorString
+
+        lib = Library()
+        error = TelldusError(TELLSTICK_ERROR_NOT_FOUND, lib=lib)
+        self.assertEqual(str(error), "an error (-1)")
+        self.assertEqual(str(error), "an error (-1)")
+        self.assertEqual(
+            str(TelldusError(TELLSTICK_ERROR_NOT_FOUND, lib=lib)),
+            "an error (-1)")
+        self.assertEqual(calls, [TELLSTICK_ERROR_NOT_FOUND])
+
+        # The cached string must not be reused with other string settings
+        Library.DECODE_STRINGS = False
+        try:
+            str(error)
+        finally:
+            Library.DECODE_STRINGS = True
+        self.assertEqual(calls, [TELLSTICK_ERROR_NOT_FOUND] * 2)
+
 if __name__ == '__main__':
     unittest.main()
@@ -18,14 +18,22 @@
 import unittest
 
 from tellcore.telldus import TelldusCore, TelldusError, Device, DeviceGroup, \
-    QueuedCallbackDispatcher
+    QueuedCallbackDispatcher, CoalescingCallbackDispatcher, \
+    AsyncioCallbackDispatcher, SensorValue
 from tellcore.constants import *
 import tellcore.library
 
 from ctypes import c_char_p, c_int
+from datetime import datetime
 import gc
+import threading
 import mocklib
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None  # Not available in python 2
+
 
 class Test(unittest.TestCase):
     def setUp(self):
@@ -119,6 +127,169 @@ class Test(unittest.TestCase):
                           self.mockdispatcher.trigger_controller_event,
                           (c_int(10), c_int(11), c_int(12), c_char_p(b"new")))
 
+    def test_coalesced_device_events(self):
+        core = TelldusCore(callback_dispatcher=CoalescingCallbackDispatcher())
+
+        events = []
+
+        def callback(*args):
+            events.append(args[:-1])
+        core.register_device_event(callback)
+
+        trigger = self.mockdispatcher.trigger_device_event
+        trigger(c_int(1), c_int(TELLSTICK_DIM), c_char_p(b"10"))
+        trigger(c_int(2), c_int(TELLSTICK_TURNON), c_char_p(b""))
+        trigger(c_int(1), c_int(TELLSTICK_DIM), c_char_p(b"20"))
+        trigger(c_int(1), c_int(TELLSTICK_DIM), c_char_p(b"30"))
+        core.callback_dispatcher.process_pending_callbacks()
+
+        self.assertEqual(events, [(1, TELLSTICK_DIM, "30"),
+                                  (2, TELLSTICK_TURNON, "")])
+
+        events[:] = []
+        core.callback_dispatcher.process_pending_callbacks()
+        self.assertEqual(events, [])
+
+    def test_coalesced_device_change_events(self):
+        core = TelldusCore(callback_dispatcher=CoalescingCallbackDispatcher())
+
+        events = []
+
+        def callback(*args):
+            events.append(args[:-1])
+        core.register_device_change_event(callback)
+
+        trigger = self.mockdispatcher.trigger_device_change_event
+        trigger(c_int(7), c_int(TELLSTICK_DEVICE_ADDED), c_int(0))
+        trigger(c_int(7), c_int(TELLSTICK_DEVICE_CHANGED),
+                c_int(TELLSTICK_CHANGE_NAME))
+        trigger(c_int(7), c_int(TELLSTICK_DEVICE_CHANGED),
+                c_int(TELLSTICK_CHANGE_NAME))
+        core.callback_dispatcher.process_pending_callbacks()
+
+        self.assertEqual(
+            events, [(7, TELLSTICK_DEVICE_ADDED, 0),
+                     (7, TELLSTICK_DEVICE_CHANGED, TELLSTICK_CHANGE_NAME)])
+
+    def test_coalesced_controller_events(self):
+        core = TelldusCore(callback_dispatcher=CoalescingCallbackDispatcher())
+
+        events = []
+
+        def callback(*args):
+            events.append(args[:-1])
+        core.register_controller_event(callback)
+
+        trigger = self.mockdispatcher.trigger_controller_event
+        trigger(c_int(1), c_int(TELLSTICK_DEVICE_STATE_CHANGED),
+                c_int(TELLSTICK_CHANGE_AVAILABLE), c_char_p(b"0"))
+        trigger(c_int(1), c_int(TELLSTICK_DEVICE_STATE_CHANGED),
+                c_int(TELLSTICK_CHANGE_FIRMWARE), c_char_p(b"2.1"))
+        trigger(c_int(1), c_int(TELLSTICK_DEVICE_STATE_CHANGED),
+                c_int(TELLSTICK_CHANGE_AVAILABLE), c_char_p(b"1"))
+        core.callback_dispatcher.process_pending_callbacks()
+
+        self.assertEqual(
+            events,
+            [(1, TELLSTICK_DEVICE_STATE_CHANGED, TELLSTICK_CHANGE_AVAILABLE,
+              "1"),
+             (1, TELLSTICK_DEVICE_STATE_CHANGED, TELLSTICK_CHANGE_FIRMWARE,
+              "2.1")])
+
+    def test_coalesced_sensor_events(self):
+        core = TelldusCore(callback_dispatcher=CoalescingCallbackDispatcher())
+
+        events = []
+
+        def callback(*args):
+            events.append(args[:-1])
+        core.register_sensor_event(callback)
+
+        def trigger(id, datatype, value, timestamp):
+            self.mockdispatcher.trigger_sensor_event(
+                c_char_p(b"fineoffset"), c_char_p(b"temperaturehumidity"),
+                c_int(id), c_int(datatype), c_char_p(value), c_int(timestamp))
+
+        trigger(11, TELLSTICK_TEMPERATURE, b"20.1", 1)
+        trigger(12, TELLSTICK_TEMPERATURE, b"18.0", 2)
+        trigger(11, TELLSTICK_HUMIDITY, b"40", 3)
+        trigger(11, TELLSTICK_TEMPERATURE, b"20.3", 4)
+        core.callback_dispatcher.process_pending_callbacks()
+
+        self.assertEqual(
+            events,
+            [("fineoffset", "temperaturehumidity", 11, TELLSTICK_TEMPERATURE,
+              "20.3", 4),
+             ("fineoffset", "temperaturehumidity", 12, TELLSTICK_TEMPERATURE,
+              "18.0", 2),
+             ("fineoffset", "temperaturehumidity", 11, TELLSTICK_HUMIDITY,
+              "40", 3)])
+
+    def test_blocking_process_callback(self):
+        dispatcher = QueuedCallbackDispatcher()
+        self.assertFalse(dispatcher.process_callback(block=False))
+
+        events = []
+        timer = threading.Timer(0.05, dispatcher.on_callback,
+                                (events.append, 1))
+        timer.start()
+        self.assertTrue(dispatcher.process_callback(block=True))
+        timer.join()
+        self.assertEqual(events, [1])
+
+    @unittest.skipIf(asyncio is None, "asyncio is not available")
+    def test_asyncio_callbacks(self):
+        loop = asyncio.new_event_loop()
+        try:
+            dispatcher = AsyncioCallbackDispatcher(loop)
+            done = loop.create_future()
+            events = []
+
+            def producer():
+                for i in range(1000):
+                    dispatcher.on_callback(events.append, i)
+                dispatcher.on_callback(done.set_result, None)
+            thread = threading.Thread(target=producer)
+            thread.start()
+            loop.run_until_complete(asyncio.wait_for(done, 5))
+            thread.join()
+
+            self.assertEqual(events, list(range(1000)))
+        finally:
+            loop.close()
+
+    @unittest.skipIf(asyncio is None, "asyncio is not available")
+    def test_asyncio_wake_up_failure(self):
+        loop = asyncio.new_event_loop()
+        try:
+            dispatcher = AsyncioCallbackDispatcher(loop)
+            done = loop.create_future()
+            events = []
+
+            def fail(*args):
+                del loop.call_soon_threadsafe
+                raise RuntimeError("Event loop is closed")
+            loop.call_soon_threadsafe = fail
+            self.assertRaises(RuntimeError, dispatcher.on_callback,
+                              events.append, 1)
+
+            # Later callbacks must still wake up the loop
+            dispatcher.on_callback(events.append, 2)
+            dispatcher.on_callback(done.set_result, None)
+            loop.run_until_complete(asyncio.wait_for(done, 5))
+
+            self.assertEqual(events, [2])
+        finally:
+            loop.close()
+
+    def test_sensor_value_datetime(self):
+        value = SensorValue(TELLSTICK_TEMPERATURE, "20.5", 1400000000)
+        self.assertEqual(datetime.fromtimestamp(1400000000), value.datetime)
+        self.assertIs(value.datetime, value.datetime)
+
+        value.timestamp = 1500000000
+        self.assertEqual(datetime.fromtimestamp(1500000000), value.datetime)
+
     def test_group(self):
         self.mocklib.tdAddDevice = lambda: 1
         self.mocklib.tdGetDeviceType = lambda id: TELLSTICK_TYPE_GROUP